@@ -0,0 +1,53 @@
+"""
+Micro-benchmark of the per-message encoding cost of stream items.
+
+Compares packing a full ``{'yield': item, 'cid': cid}`` message with
+``msgpack.dumps()`` on every send (as was previously done) against
+the default codec's reused ``msgpack.Packer`` only packing ``item``
+behind a pre-encoded message envelope (as ``Context.send_yield()`` now
+does).
+"""
+import timeit
+from uuid import uuid4
+
+import msgpack
+from tractor._codec import MsgpackCodec
+
+
+cid = str(uuid4())
+items = {
+    'int': 10,
+    'str': 'doggy' * 10,
+    'bytes': b'x' * 1024,
+    'record': {'symbol': 'XBTUSD', 'price': 1e4, 'size': 10, 'side': 'buy'},
+}
+
+
+def full_message(item):
+    return msgpack.dumps({'yield': item, 'cid': cid}, use_bin_type=True)
+
+
+codec = MsgpackCodec()
+yield_env = codec.envelope('yield', cid)
+
+
+def enveloped(item):
+    # the stream joins the prefix and payload into a single frame
+    return b''.join(codec.encode_enveloped(yield_env, item))
+
+
+if __name__ == '__main__':
+    n = 20000
+    for name, item in items.items():
+        # both encodings decode to the same message
+        assert codec.decode(full_message(item)) == codec.decode(
+            enveloped(item))
+
+        before = min(timeit.repeat(
+            lambda: full_message(item), number=n, repeat=3)) / n
+        after = min(timeit.repeat(
+            lambda: enveloped(item), number=n, repeat=3)) / n
+        print(
+            f"{name:>8}: {before * 1e9:8.0f} ns -> {after * 1e9:8.0f} ns "
+            f"per message ({before / after:.2f}x)"
+        )
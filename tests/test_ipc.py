@@ -0,0 +1,239 @@
+"""
+Channel transport, message framing and codecs
+"""
+import datetime
+import pickle
+
+import pytest
+import trio
+import tractor
+
+from tractor._codec import PickleCodec, has_pickle5, negotiate
+from tractor._ipc import MsgpackStream, uds_path
+
+
+async def stream_pair():
+    """Return a connected pair of ``MsgpackStream``s over loopback TCP.
+    """
+    listeners = await trio.open_tcp_listeners(0, host='127.0.0.1')
+    listener = listeners[0]
+    host, port = listener.socket.getsockname()
+    client = await trio.open_tcp_stream(host, port)
+    server = await listener.accept()
+    await listener.aclose()
+    return MsgpackStream(client), MsgpackStream(server)
+
+
+@pytest.mark.trio
+async def test_recv_buffer_resizes_to_frame_sizes():
+    """Large frames grow the receive buffer which is shrunk back once
+    small frames are all that's arriving.
+    """
+    tx, rx = await stream_pair()
+    big = b'x' * (4 * MsgpackStream.min_bufsize + 1)
+    msgs = [{'i': i} for i in range(100)] + [big] + [
+        {'i': i} for i in range(100)]
+
+    async with trio.open_nursery() as n:
+
+        async def send_all():
+            for msg in msgs:
+                await tx.send(msg)
+
+        n.start_soon(send_all)
+
+        for msg in msgs:
+            assert await rx.recv() == msg
+            if msg is big:
+                assert rx._bufsize > len(big)
+
+    assert rx._bufsize == MsgpackStream.min_bufsize
+
+    await tx.stream.aclose()
+    with pytest.raises(StopAsyncIteration):
+        await rx.recv()
+
+
+async def get_parent_raddr():
+    return tractor.current_actor()._parent_chan.raddr
+
+
+def test_same_host_peers_connect_over_uds(arb_addr, start_method):
+    """Actors serving a unix domain socket are connected to through it
+    by peers on the same host.
+    """
+    async def main():
+        async with tractor.open_nursery() as n:
+            portal = await n.start_actor(
+                'uds_child',
+                rpc_module_paths=[__name__],
+            )
+            # connected back to us through our unix socket
+            assert isinstance(portal.channel.laddr, str)
+            path = await portal.run(__name__, 'get_parent_raddr')
+            assert path == uds_path(tractor.current_actor().accept_addr)
+            await portal.cancel_actor()
+
+    tractor.run(
+        main,
+        arbiter_addr=arb_addr,
+        start_method=start_method,
+        enable_uds=True,
+    )
+
+
+@pytest.mark.trio
+async def test_coalesced_sends_arrive_in_order():
+    """Messages sent concurrently on a coalescing stream are batched
+    into fewer writes and arrive in send order per sender.
+    """
+    tx, rx = await stream_pair()
+    tx.coalesce(max_latency=0.01, max_bytes=2**12)
+    writes = 0
+    send_all = tx.stream.send_all
+
+    async def counting_send_all(data):
+        nonlocal writes
+        writes += 1
+        await send_all(data)
+
+    tx.stream.send_all = counting_send_all
+    nsenders, count = 4, 1000
+
+    async with trio.open_nursery() as n:
+
+        async def send_all_msgs(sender):
+            for i in range(count):
+                await tx.send((sender, i))
+
+        for sender in range(nsenders):
+            n.start_soon(send_all_msgs, sender)
+
+        last = [-1] * nsenders
+        for _ in range(nsenders * count):
+            sender, i = await rx.recv()
+            assert i == last[sender] + 1
+            last[sender] = i
+
+    assert writes < nsenders * count / 10
+
+    await tx.aclose()
+    with pytest.raises(StopAsyncIteration):
+        await rx.recv()
+
+
+@pytest.mark.trio
+async def test_enveloped_sends_decode_as_full_msgs():
+    """Values sent behind a pre-encoded envelope arrive as the same
+    message as if it had been packed in full.
+    """
+    tx, rx = await stream_pair()
+    cid = 'doggy-cid'
+    env = tx.codec.envelope('yield', cid)
+    items = [None, 10, 'doggy', b'x' * 100, {'nested': (1, 2)}]
+
+    for item in items:
+        await tx.send_enveloped(env, item)
+        assert await rx.recv() == {'yield': item, 'cid': cid}
+
+    await tx.aclose()
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
+tractor.register_ext_type(
+    Point, 16,
+    lambda p: bytes((p.x, p.y)),
+    lambda data: Point(*data),
+)
+
+
+@pytest.mark.trio
+async def test_msgpack_ext_types():
+    """Builtin and registered ext types round trip through the default
+    codec.
+    """
+    tx, rx = await stream_pair()
+    now = datetime.datetime.now()
+    items = [
+        now,
+        now.replace(tzinfo=datetime.timezone.utc),
+        now.date(),
+        datetime.timedelta(days=-1, microseconds=10),
+    ]
+    for item in items:
+        await tx.send({'item': item})
+        assert await rx.recv() == {'item': item}
+
+    await tx.send(Point(1, 2))
+    point = await rx.recv()
+    assert (point.x, point.y) == (1, 2)
+
+    await tx.aclose()
+
+
+@pytest.mark.skipif(not has_pickle5, reason="Requires pickle protocol 5")
+@pytest.mark.trio
+async def test_pickle_codec_out_of_band_buffers():
+    """``PickleBuffer`` exposing objects are appended to the frame
+    instead of being copied into the pickle stream.
+    """
+    tx, rx = await stream_pair()
+    tx.set_codec(PickleCodec())
+    rx.set_codec(PickleCodec())
+
+    buf = bytearray(b'x' * 2**20)
+    parts = tx.codec.encode({'buf': pickle.PickleBuffer(buf)})
+    assert len(parts) == 3 and parts[-1].nbytes == len(buf)
+
+    msg = {
+        'buf': pickle.PickleBuffer(buf),
+        'point': Point(3, 4),
+        'when': datetime.date.today(),
+    }
+    await tx.send(msg)
+    got = await rx.recv()
+    assert got['buf'] == buf
+    assert got['when'] == msg['when']
+    assert (got['point'].x, got['point'].y) == (3, 4)
+
+    await tx.aclose()
+
+
+def test_codec_negotiation():
+    """The accepting end's most preferred codec listed by both ends
+    is chosen, falling back to ``msgpack``.
+    """
+    assert negotiate(['pickle', 'msgpack'], ['msgpack', 'pickle']) == 'pickle'
+    assert negotiate(['msgpack', 'pickle'], ['pickle', 'msgpack']) == 'msgpack'
+    assert negotiate(['pickle'], ['msgpack']) == 'msgpack'
+
+
+async def get_parent_codec():
+    return tractor.current_actor()._parent_chan.codec.name
+
+
+@pytest.mark.skipif(not has_pickle5, reason="Requires pickle protocol 5")
+def test_actors_negotiate_codec(arb_addr, start_method):
+    """Child actors inherit their parent's codecs and negotiate them
+    on the parent channel.
+    """
+    async def main():
+        async with tractor.open_nursery() as n:
+            portal = await n.start_actor(
+                'codec_child',
+                rpc_module_paths=[__name__],
+            )
+            assert portal.channel.codec.name == 'pickle'
+            assert await portal.run(__name__, 'get_parent_codec') == 'pickle'
+            await portal.cancel_actor()
+
+    tractor.run(
+        main,
+        arbiter_addr=arb_addr,
+        start_method=start_method,
+        codecs=['pickle', 'msgpack'],
+    )
@@ -246,3 +246,43 @@ def test_not_fast_enough_quad(
     else:
         # should be cancelled mid-streaming
         assert results is None
+
+
+async def mixed_size_stream(sizes):
+    for i, size in enumerate(sizes):
+        yield i, b'x' * size
+
+
+@pytest.mark.skipif(
+    not tractor._shm.has_shm,
+    reason="Shared memory requires python 3.8+",
+)
+def test_shm_stream_keeps_order(arb_addr, start_method):
+    """Items are delivered in order when streaming over shared memory
+    including those too large for the ring buffer (sent inline).
+    """
+    ring_size = tractor._shm.ShmStreamSender.capacity
+    sizes = [0, 10, ring_size // 2, ring_size + 1, 10, ring_size, 0] * 10
+
+    async def main():
+        async with tractor.open_nursery() as n:
+            portal = await n.start_actor(
+                'shm_streamer',
+                rpc_module_paths=[__name__],
+            )
+            stream = await portal.run(
+                __name__, 'mixed_size_stream', sizes=sizes)
+            received = []
+            async for i, data in stream:
+                assert len(data) == sizes[i]
+                received.append(i)
+
+            assert received == list(range(len(sizes)))
+            await portal.cancel_actor()
+
+    tractor.run(
+        main,
+        arbiter_addr=arb_addr,
+        start_method=start_method,
+        enable_shm=True,
+    )
@@ -12,6 +12,7 @@ from trio import MultiError
 
 from . import log
 from ._ipc import _connect_chan, Channel
+from ._codec import Codec, register_codec, register_ext_type
 from ._streaming import Context, stream
 from ._discovery import get_arbiter, find_actor, wait_for_actor
 from ._actor import Actor, _start_actor, Arbiter
@@ -33,12 +34,15 @@ __all__ = [
     'open_nursery',
     'wait_for_actor',
     'Channel',
+    'Codec',
     'Context',
     'stream',
     'MultiError',
     'RemoteActorError',
     'ModuleNotExposed',
-    'msg'
+    'msg',
+    'register_codec',
+    'register_ext_type',
 ]
 
 
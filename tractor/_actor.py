@@ -19,7 +19,10 @@ import trio  # type: ignore
 from trio_typing import TaskStatus
 from async_generator import aclosing
 
-from ._ipc import Channel
+from ._ipc import Channel, has_uds, uds_path, open_uds_listener
+from ._codec import MsgpackCodec, negotiate, _codecs
+from ._shm import ShmStreamSender, has_shm, same_host
+from . import _shm
 from ._streaming import Context, _context
 from .log import get_logger
 from ._exceptions import (
@@ -54,9 +57,31 @@ async def _invoke(
     treat_as_gen = False
     cs = None
     cancel_scope = trio.CancelScope()
-    ctx = Context(chan, cid, cancel_scope)
+    is_stream_func = getattr(func, '_tractor_stream_function', False)
+    shm_tx = None
+
+    def _started(cs: trio.CancelScope) -> None:
+        # register the task *before* the msg loop is resumed since the
+        # task may complete (and remove itself below) before the loop
+        # runs again; never allow cancelling cancel requests (results
+        # in deadlock and other weird behaviour)
+        if func != actor.cancel:
+            # mark that we have ongoing rpc tasks
+            actor._ongoing_rpc_tasks = trio.Event()
+            # store cancel scope such that the rpc task can be
+            # cancelled gracefully if requested
+            actor._rpc_tasks[(chan, cid)] = (cs, func, trio.Event())
+        task_status.started(cs)
+
+    if actor._enable_shm and same_host(chan) and (
+        is_stream_func or inspect.isasyncgenfunction(
+            func.func if isinstance(func, partial) else func)
+    ):
+        # stream items to the (same-host) caller through shared memory
+        shm_tx = ShmStreamSender(actor, chan, cid)
+    ctx = Context(chan, cid, cancel_scope, shm_tx)
     _context.set(ctx)
-    if getattr(func, '_tractor_stream_function', False):
+    if is_stream_func:
         # handle decorated ``@tractor.stream`` async functions
         kwargs['ctx'] = ctx
         treat_as_gen = True
@@ -75,7 +100,7 @@ async def _invoke(
         ):
             await chan.send({'functype': 'function', 'cid': cid})
             with cancel_scope as cs:
-                task_status.started(cs)
+                _started(cs)
                 await chan.send({'return': func(**kwargs), 'cid': cid})
         else:
             coro = func(**kwargs)
@@ -90,7 +115,7 @@ async def _invoke(
                 # of the async gen in order to be sure the cancel
                 # is propagated!
                 with cancel_scope as cs:
-                    task_status.started(cs)
+                    _started(cs)
                     async with aclosing(coro) as agen:
                         async for item in agen:
                             # TODO: can we send values back in here?
@@ -100,7 +125,7 @@ async def _invoke(
                             # to_send = await chan.recv_nowait()
                             # if to_send is not None:
                             #     to_yield = await coro.asend(to_send)
-                            await chan.send({'yield': item, 'cid': cid})
+                            await ctx.send_yield(item)
 
                 log.debug(f"Finished iterating {coro}")
                 # TODO: we should really support a proper
@@ -115,7 +140,7 @@ async def _invoke(
                     # manualy construct the response dict-packet-responses as
                     # above
                     with cancel_scope as cs:
-                        task_status.started(cs)
+                        _started(cs)
                         await coro
                     if not cs.cancelled_caught:
                         # task was not cancelled so we can instruct the
@@ -124,7 +149,7 @@ async def _invoke(
                 else:
                     await chan.send({'functype': 'asyncfunction', 'cid': cid})
                     with cancel_scope as cs:
-                        task_status.started(cs)
+                        _started(cs)
                         await chan.send({'return': await coro, 'cid': cid})
     except (Exception, trio.MultiError) as err:
         # NOTE: don't enter debug mode recursively after quitting pdb
@@ -143,6 +168,9 @@ async def _invoke(
             # error is from above code not from rpc invocation
             task_status.started(err)
     finally:
+        if shm_tx is not None:
+            await shm_tx.aclose()
+
         # RPC task bookeeping
         try:
             scope, func, is_complete = actor._rpc_tasks.pop((chan, cid))
@@ -191,7 +219,11 @@ class Actor:
         uid: str = None,
         loglevel: str = None,
         arbiter_addr: Optional[Tuple[str, int]] = None,
-        spawn_method: Optional[str] = None
+        spawn_method: Optional[str] = None,
+        enable_uds: bool = False,
+        enable_shm: bool = False,
+        write_coalescing: Optional[Tuple[float, int]] = None,
+        codecs: Optional[List[str]] = None,
     ) -> None:
         """This constructor is called in the parent actor **before** the spawning
         phase (aka before a new process is executed).
@@ -228,6 +260,25 @@ class Actor:
         # by the user (currently called the "arbiter")
         self._spawn_method = spawn_method
 
+        # serve a unix domain socket alongside the tcp server such that
+        # same-host peers can avoid the loopback tcp stack
+        self._enable_uds = enable_uds and has_uds
+
+        # stream to same-host callers through shared memory
+        self._enable_shm = enable_shm and has_shm
+        # (uid, cid) -> producer/consumer ends of shared memory streams
+        self._shm_txs: Dict[Tuple[Tuple[str, str], str], ShmStreamSender] = {}
+        self._shm_rxs: Dict[
+            Tuple[Tuple[str, str], str], _shm.ShmStreamReceiver] = {}
+
+        # (max latency, max bytes) used to batch writes on every
+        # channel we process messages for, see ``Channel.coalesce()``
+        self._write_coalescing = write_coalescing
+
+        # names of the codecs this actor is willing to use in order of
+        # preference, see ``_do_handshake()``
+        self._codecs = list(codecs or [MsgpackCodec.name])
+
         self._peers: defaultdict = defaultdict(list)
         self._peer_connected: dict = {}
         self._no_more_peers = trio.Event()
@@ -390,19 +441,62 @@ class Actor:
         actorid = chan.uid
         assert actorid, f"`actorid` can't be {actorid}"
         cid = msg['cid']
+
+        if 'shm_ack' in msg:
+            # we're the producer end of a shared memory stream
+            shm_tx = self._shm_txs.get((actorid, cid))
+            if shm_tx is not None:
+                await shm_tx._on_ack(msg['shm_ack'])
+            return
+
+        if 'shm_open' in msg:
+            # we're the consumer end of a shared memory stream
+            shm_rx = _shm.attach(msg['shm_open'], msg['size'], chan.codec)
+            if shm_rx is not None:
+                self._shm_rxs[(actorid, cid)] = shm_rx
+            await chan.send({'shm_ack': shm_rx is not None, 'cid': cid})
+            return
+
         send_chan, recv_chan = self._cids2qs[(actorid, cid)]
         assert send_chan.cid == cid  # type: ignore
-        if 'stop' in msg:
-            log.debug(f"{send_chan} was terminated at remote end")
-            return await send_chan.aclose()
-        try:
-            log.debug(f"Delivering {msg} from {actorid} to caller {cid}")
-            # maintain backpressure
-            await send_chan.send(msg)
-        except trio.BrokenResourceError:
-            # XXX: local consumer has closed their side
-            # so cancel the far end streaming task
-            log.warning(f"{send_chan} consumer is already closed")
+
+        msgs = [msg]
+        shm_rx = self._shm_rxs.get((actorid, cid))
+        if shm_rx is not None:
+            # deliver all items written to shared memory before ``msg``
+            # was sent such that ordering is maintained
+            until = msg.get('shm_wakeup', msg.get('shm_pos'))
+            msgs = [
+                {'yield': item, 'cid': cid}
+                for item in shm_rx.drain(until)
+            ] + msgs
+            if 'shm_wakeup' in msg:
+                await chan.send({'shm_ack': True, 'cid': cid})
+            elif 'stop' in msg or 'error' in msg:
+                self._close_shm_stream(actorid, cid)
+
+        for msg in msgs:
+            if 'shm_wakeup' in msg:
+                continue
+            if 'stop' in msg:
+                log.debug(f"{send_chan} was terminated at remote end")
+                return await send_chan.aclose()
+            try:
+                log.debug(f"Delivering {msg} from {actorid} to caller {cid}")
+                # maintain backpressure
+                await send_chan.send(msg)
+            except trio.BrokenResourceError:
+                # XXX: local consumer has closed their side
+                # so cancel the far end streaming task
+                log.warning(f"{send_chan} consumer is already closed")
+                return
+
+    def _close_shm_stream(self, actorid: Tuple[str, str], cid: str) -> None:
+        """Detach from a shared memory stream's ring buffer.
+        """
+        shm_rx = self._shm_rxs.pop((actorid, cid), None)
+        if shm_rx is not None:
+            shm_rx.close()
 
     def get_memchans(
         self,
@@ -451,6 +545,9 @@ class Actor:
         # TODO: once https://github.com/python-trio/trio/issues/467 gets
         # worked out we'll likely want to use that!
         msg = None
+        if self._write_coalescing is not None:
+            chan.coalesce(*self._write_coalescing)
+
         log.debug(f"Entering msg loop for {chan} from {chan.uid}")
         try:
             with trio.CancelScope(shield=shield) as loop_cs:
@@ -527,20 +624,14 @@ class Actor:
                         partial(_invoke, self, cid, chan, func, kwargs),
                         name=funcname,
                     )
-                    # never allow cancelling cancel requests (results in
-                    # deadlock and other weird behaviour)
+                    # the task registers itself in ``_rpc_tasks`` (see
+                    # ``_invoke()``) unless it's a cancel request
                     if func != self.cancel:
                         if isinstance(cs, Exception):
                             log.warning(f"Task for RPC func {func} failed with"
                                      f"{cs}")
                         else:
-                            # mark that we have ongoing rpc tasks
-                            self._ongoing_rpc_tasks = trio.Event()
                             log.info(f"RPC func is {func}")
-                            # store cancel scope such that the rpc task can be
-                            # cancelled gracefully if requested
-                            self._rpc_tasks[(chan, cid)] = (
-                                cs, func, trio.Event())
                     else:
                         # self.cancel() was called so kill this msg loop
                         # and break out into ``_async_main()``
@@ -819,6 +910,7 @@ class Actor:
         ``cancel_server()`` is called.
         """
         self._server_down = trio.Event()
+        uds_addr: Optional[str] = None
         try:
             async with trio.open_nursery() as server_n:
                 listeners: List[trio.abc.Listener] = await server_n.start(
@@ -835,8 +927,32 @@ class Actor:
                 log.debug("Started tcp server(s) on"  # type: ignore
                           f" {[l.socket for l in listeners]}")
                 self._listeners.extend(listeners)
+
+                if self._enable_uds:
+                    # bound at a path derived from our primary tcp
+                    # address such that peers can find it without any
+                    # extra addressing
+                    uds_addr = uds_path(self.accept_addr)
+                    uds_listener = await open_uds_listener(uds_addr)
+                    await server_n.start(
+                        partial(
+                            trio.serve_listeners,
+                            self._stream_handler,
+                            [uds_listener],
+                            handler_nursery=handler_nursery,
+                        )
+                    )
+                    log.debug(
+                        f"Started uds server on {uds_listener.socket}")
+                    self._listeners.append(uds_listener)
+
                 task_status.started(server_n)
         finally:
+            if uds_addr is not None:
+                try:
+                    os.unlink(uds_addr)
+                except OSError:
+                    pass
             # signal the server is down since nursery above terminated
             self._server_down.set()
 
@@ -977,15 +1093,31 @@ class Actor:
 
         These are essentially the "mailbox addresses" found in actor model
         parlance.
+
+        The codec used for all following messages is negotiated in the
+        same step: both ends send the (registered) codecs they're willing
+        to use in order of preference and the accepting end's most
+        preferred one also listed by the connecting end is chosen.
         """
+        codecs = [name for name in self._codecs if name in _codecs]
         await chan.send(self.uid)
+        await chan.send(codecs)
         uid: Tuple[str, str] = await chan.recv()
 
         if not isinstance(uid, tuple):
             raise ValueError(f"{uid} is not a valid uid?!")
 
+        peer_codecs = await chan.recv()
+        if chan.accepted:
+            codec = negotiate(codecs, peer_codecs)
+        else:
+            codec = negotiate(peer_codecs, codecs)
+        chan.set_codec(codec)
+
         chan.uid = uid
-        log.info(f"Handshake with actor {uid}@{chan.raddr} complete")
+        log.info(
+            f"Handshake with actor {uid}@{chan.raddr} complete"
+            f" using {codec}")
         return uid
 
 
@@ -25,13 +25,15 @@ if __name__ == "__main__":
     parser.add_argument("--uid", type=parse_uid)
     parser.add_argument("--loglevel", type=str)
     parser.add_argument("--parent_addr", type=parse_ipaddr)
+    parser.add_argument("--codecs", type=lambda arg: arg.split(','))
     args = parser.parse_args()
 
     subactor = Actor(
         args.uid[0],
         uid=args.uid[1],
         loglevel=args.loglevel,
-        spawn_method="trio"
+        spawn_method="trio",
+        codecs=args.codecs,
     )
 
     _trio_main(
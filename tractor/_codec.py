@@ -0,0 +1,268 @@
+"""
+Message codecs for channels.
+
+Every channel starts out speaking ``msgpack`` and both ends then
+negotiate the codec used for the rest of the connection during the
+actor handshake (see ``Actor._do_handshake()``); the accepting actor's
+most preferred codec which the connecting actor also lists is used.
+
+Custom ``msgpack`` extension types can be registered with
+``register_ext_type()`` and further codecs with ``register_codec()``.
+"""
+import datetime
+import pickle
+import struct
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Type
+
+import msgpack
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# out-of-band buffers were added to ``pickle`` in protocol 5 (py3.8+)
+has_pickle5 = pickle.HIGHEST_PROTOCOL >= 5
+
+# type -> (ext type code, encoder)
+_ext_encoders: Dict[type, Tuple[int, Callable[[Any], bytes]]] = {}
+# ext type code -> decoder
+_ext_decoders: Dict[int, Callable[[bytes], Any]] = {}
+
+
+def register_ext_type(
+    typ: type,
+    code: int,
+    encode: Callable[[Any], bytes],
+    decode: Callable[[bytes], Any],
+) -> None:
+    """Register a ``msgpack`` extension type for instances of ``typ``.
+
+    ``encode`` must return the ``bytes`` representation of an instance
+    which ``decode`` turns back into the original object. Codes are
+    in the range 0-127 with 0-15 reserved for use by ``tractor``.
+    Extension types must be registered (with the same code) by every
+    actor which sends or receives them.
+    """
+    if not 0 <= code <= 127:
+        raise ValueError(f"Ext type code {code} is not in the range 0-127")
+    registered = _ext_decoders.get(code)
+    if registered is not None and registered is not decode:
+        raise ValueError(f"Ext type code {code} is already registered")
+
+    _ext_encoders[typ] = (code, encode)
+    _ext_decoders[code] = decode
+
+
+class Codec:
+    """Encoder/decoder of the messages sent over a channel.
+
+    ``encode()`` returns the parts making up a single frame on the wire
+    which ``decode()`` is handed as one contiguous buffer. The buffer
+    is only valid for the duration of the call.
+    """
+    name: str
+
+    def encode(self, obj: Any) -> Tuple[bytes, ...]:
+        raise NotImplementedError
+
+    def decode(self, frame: memoryview) -> Any:
+        raise NotImplementedError
+
+    def envelope(self, key: str, cid: str) -> Any:
+        """Return an envelope for ``{'cid': cid, key: value}`` messages
+        to be passed to ``.encode_enveloped()``.
+        """
+        return key, cid
+
+    def encode_enveloped(self, env: Any, value: Any) -> Tuple[bytes, ...]:
+        """Encode the message made of ``value`` wrapped in ``env``.
+        """
+        key, cid = env
+        return self.encode({key: value, 'cid': cid})
+
+
+def _ext_default(obj: Any) -> msgpack.ExtType:
+    try:
+        code, encode = _ext_encoders[type(obj)]
+    except KeyError:
+        # subclasses of registered types
+        for typ, (code, encode) in _ext_encoders.items():
+            if isinstance(obj, typ):
+                break
+        else:
+            raise TypeError(f"Can not serialize {type(obj)}: {obj!r}")
+
+    return msgpack.ExtType(code, encode(obj))
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    try:
+        return _ext_decoders[code](data)
+    except KeyError:
+        return msgpack.ExtType(code, data)
+
+
+class MsgpackCodec(Codec):
+    """The default (and handshake) codec.
+    """
+    name = 'msgpack'
+
+    def __init__(self) -> None:
+        # reused for every message; ``.pack()`` doesn't yield to the
+        # scheduler so it's safe to share between tasks
+        self._packer = msgpack.Packer(
+            use_bin_type=True,
+            default=_ext_default,
+        )
+
+    def encode(self, obj: Any) -> Tuple[bytes, ...]:
+        return self._packer.pack(obj),
+
+    def decode(self, frame: memoryview) -> Any:
+        return msgpack.unpackb(
+            frame,
+            raw=False,
+            use_list=False,
+            ext_hook=_ext_hook,
+            # NOTE: required since we have tuples as keys (see
+            # ``Arbiter.get_registry()``)
+            strict_map_key=False,
+        )
+
+    def envelope(self, key: str, cid: str) -> bytes:
+        """Pre-encode the ``msgpack`` prefix of a ``{'cid': cid, key:
+        value}`` message such that only ``value`` needs to be packed on
+        every send for a given ``cid``.
+        """
+        return b''.join((
+            b'\x82',  # fixmap of 2 entries
+            msgpack.packb('cid'),
+            msgpack.packb(cid),
+            msgpack.packb(key),
+        ))
+
+    def encode_enveloped(self, env: bytes, value: Any) -> Tuple[bytes, ...]:
+        return env, self._packer.pack(value)
+
+
+class PickleCodec(Codec):
+    """``pickle`` protocol 5 with out-of-band buffers.
+
+    Buffers exposed through ``pickle.PickleBuffer`` (``numpy`` arrays,
+    ``PickleBuffer`` wrapped ``bytearray``s, ...) aren't copied into the
+    pickle stream but appended to the frame as is; they're received as
+    (writeable) ``bytearray``s. The frame layout is
+    the buffer count followed by the length of each buffer, the pickle
+    stream and the buffers.
+
+    Unpickling runs arbitrary code so only list this codec for actors
+    which trust each other.
+    """
+    name = 'pickle'
+    _count = struct.Struct('!I')
+    _len = struct.Struct('!Q')
+
+    def encode(self, obj: Any) -> Tuple[bytes, ...]:
+        buffers: List[pickle.PickleBuffer] = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        raws = [buf.raw() for buf in buffers]
+        hdr = self._count.pack(len(raws)) + b''.join(
+            self._len.pack(raw.nbytes) for raw in raws)
+        return (hdr, data, *raws)
+
+    def decode(self, frame: memoryview) -> Any:
+        count, = self._count.unpack_from(frame)
+        offset = self._count.size
+        lens = []
+        for _ in range(count):
+            lens.append(self._len.unpack_from(frame, offset)[0])
+            offset += self._len.size
+
+        end = len(frame) - sum(lens)
+        data = frame[offset:end]
+        buffers = []
+        for size in lens:
+            # copy out of the (reused) frame buffer
+            buffers.append(bytearray(frame[end:end + size]))
+            end += size
+
+        return pickle.loads(data, buffers=buffers)
+
+
+_codecs: Dict[str, Type[Codec]] = {}
+
+
+def register_codec(codec: Type[Codec]) -> None:
+    """Make ``codec`` available for negotiation under ``codec.name``.
+    """
+    _codecs[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    """Return a new instance of the codec registered as ``name``.
+    """
+    return _codecs[name]()
+
+
+def negotiate(
+    accepting: Sequence[str],
+    connecting: Sequence[str],
+) -> str:
+    """Return the name of the codec to use on a channel given the
+    preferred codecs of the accepting and connecting actors.
+
+    Falls back to ``msgpack`` if no (registered) codec is listed by
+    both actors.
+    """
+    for name in accepting:
+        if name in connecting and name in _codecs:
+            return name
+    return MsgpackCodec.name
+
+
+register_codec(MsgpackCodec)
+if has_pickle5:
+    register_codec(PickleCodec)
+
+
+# builtin ext types
+
+_timedelta = struct.Struct('!qii')
+
+register_ext_type(
+    datetime.datetime, 1,
+    lambda dt: dt.isoformat().encode(),
+    lambda data: datetime.datetime.fromisoformat(data.decode()),
+)
+register_ext_type(
+    datetime.date, 2,
+    lambda d: d.isoformat().encode(),
+    lambda data: datetime.date.fromisoformat(data.decode()),
+)
+register_ext_type(
+    datetime.timedelta, 3,
+    lambda td: _timedelta.pack(td.days, td.seconds, td.microseconds),
+    lambda data: datetime.timedelta(*_timedelta.unpack(data)),
+)
+
+
+def _encode_ndarray(arr: 'numpy.ndarray') -> bytes:
+    if arr.dtype.hasobject:
+        raise TypeError(f"Can not serialize object arrays: {arr!r}")
+    return msgpack.packb(
+        (arr.dtype.str, arr.shape, arr.tobytes()),
+        use_bin_type=True,
+    )
+
+
+def _decode_ndarray(data: bytes) -> 'numpy.ndarray':
+    dtype, shape, buf = msgpack.unpackb(data, raw=False)
+    # ``bytearray`` such that the array is writeable
+    return numpy.frombuffer(
+        bytearray(buf), dtype=dtype).reshape(shape)
+
+
+if numpy is not None:
+    register_ext_type(numpy.ndarray, 4, _encode_ndarray, _decode_ndarray)
+
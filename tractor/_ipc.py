@@ -2,65 +2,203 @@
 Inter-process comms abstractions
 """
 import typing
-from typing import Any, Tuple, Optional
-from functools import partial
+from typing import Any, Tuple, Optional, Union
 import inspect
+import struct
+import errno
+import os
+import socket
+import tempfile
 
-import msgpack
 import trio
 from async_generator import asynccontextmanager
 
+from ._codec import Codec, MsgpackCodec, get_codec
 from .log import get_logger
 log = get_logger('ipc')
 
-# :eyeroll:
-try:
-    import msgpack_numpy
-    Unpacker = msgpack_numpy.Unpacker
-except ImportError:
-    # just plain ``msgpack`` requires tweaking key settings
-    Unpacker = partial(msgpack.Unpacker, strict_map_key=False)
+
+# every encoded message on the wire is prefixed with its length
+# (network byte order) such that complete frames can be decoded
+# directly out of the receive buffer
+_frame_hdr = struct.Struct('!I')
+
+
+# unix domain sockets for same-host actors are bound at a path
+# derived from the actor's (primary) tcp address
+_uds_dir = tempfile.gettempdir()
+has_uds = hasattr(socket, 'AF_UNIX')
+
+
+def uds_path(addr: Tuple[str, int]) -> str:
+    """Return the unix domain socket path which accompanies the tcp
+    ``addr`` of an actor's channel server.
+    """
+    host, port = addr[:2]
+    return os.path.join(_uds_dir, f'tractor-{host}-{port}.sock')
+
+
+async def open_uds_listener(path: str) -> trio.SocketListener:
+    """Bind a unix domain socket at ``path`` and start listening.
+    """
+    sock = trio.socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # remove any stale socket left by a (crashed) actor
+        # previously bound to the same tcp address
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    await sock.bind(path)
+    sock.listen(socket.SOMAXCONN)
+    return trio.SocketListener(sock)
 
 
 class MsgpackStream:
-    """A ``trio.SocketStream`` delivering ``msgpack`` formatted data.
+    """A ``trio.SocketStream`` delivering ``msgpack`` formatted data
+    (or that of whichever codec was set with ``.set_codec()``).
+
+    Inbound bytes are read (using ``recv_into()``) into a single
+    preallocated receive buffer which is grown to fit the largest frame
+    seen on the wire and shrunk back once large frames stop arriving.
+
+    Outbound messages can optionally be coalesced (see ``.coalesce()``)
+    in which case they're packed into a shared buffer which is flushed
+    by a dedicated writer task with a single ``send_all()``.
     """
+    # smallest (and initial) size of the receive buffer
+    min_bufsize: int = 2**16
+    # weight of the most recent frame size in the moving average
+    # used to decide when to give back memory after large frames
+    _avg_weight: float = 0.1
+
     def __init__(self, stream: trio.SocketStream) -> None:
         self.stream = stream
         assert self.stream.socket
-        # should both be IP sockets
         lsockname = stream.socket.getsockname()
-        assert isinstance(lsockname, tuple)
-        self._laddr = lsockname[:2]
         rsockname = stream.socket.getpeername()
-        assert isinstance(rsockname, tuple)
-        self._raddr = rsockname[:2]
+        if stream.socket.family == getattr(socket, 'AF_UNIX', None):
+            # unix domain sockets are addressed by filesystem path
+            # (the connecting side's is normally empty)
+            self._laddr = lsockname
+            self._raddr = rsockname
+        else:
+            # should both be IP sockets
+            assert isinstance(lsockname, tuple)
+            self._laddr = lsockname[:2]
+            assert isinstance(rsockname, tuple)
+            self._raddr = rsockname[:2]
+
+        self._bufsize = self.min_bufsize
+        self._avg_frame_size: float = 0
 
         self._agen = self._iter_packets()
         self._send_lock = trio.StrictFIFOLock()
+        self.codec: Codec = MsgpackCodec()
+
+        # write coalescing, enabled by ``.coalesce()``
+        self._max_latency: Optional[float] = None
+        self._max_bytes: int = 0
+        self._outbuf = bytearray()
+        self._pending = trio.Event()  # data was added to the buffer
+        self._full = trio.Event()  # buffer reached ``max_bytes``
+        self._flushed = trio.Event()  # buffer was written to the stream
+        self._writer_err: Optional[BaseException] = None
+        self._writer_running = False
+
+    def _fit_bufsize(self, frame_size: int) -> int:
+        """Return a receive buffer size adjusted to the observed frame
+        sizes.
+
+        The moving average follows large frames immediately but decays
+        slowly such that a stream of large frames doesn't cause the
+        buffer to be reallocated on every read.
+        """
+        avg = self._avg_frame_size
+        if frame_size > avg:
+            avg = frame_size
+        else:
+            w = self._avg_weight
+            avg = (1 - w) * avg + w * frame_size
+        self._avg_frame_size = avg
+
+        # give back memory once large frames stop arriving
+        if self._bufsize > max(self.min_bufsize, 4 * avg):
+            self._bufsize = max(
+                self.min_bufsize,
+                1 << int(2 * avg).bit_length(),
+            )
+        return self._bufsize
 
     async def _iter_packets(self) -> typing.AsyncGenerator[dict, None]:
         """Yield packets from the underlying stream.
         """
-        unpacker = Unpacker(
-            raw=False,
-            use_list=False,
-        )
+        hdr_size = _frame_hdr.size
+        sock = self.stream.socket
+        buf = bytearray(self._bufsize)
+        view = memoryview(buf)
+        # pending (received but not yet decoded) bytes are ``buf[start:end]``
+        start = end = 0
+
         while True:
+            # decode all complete frames currently buffered
+            need = hdr_size
+            while end - start >= hdr_size:
+                size, = _frame_hdr.unpack_from(buf, start)
+                need = hdr_size + size
+                if end - start < need:
+                    break
+
+                packet = self.codec.decode(
+                    view[start + hdr_size:start + need])
+                start += need
+                need = hdr_size
+                self._fit_bufsize(size)
+                yield packet
+
+            pending = end - start
+            if not pending:
+                start = end = 0
+
+            bufsize = self._bufsize
+            if need > bufsize:
+                # grow to fit the next (large) frame
+                bufsize = self._bufsize = 1 << (need - 1).bit_length()
+
+            if bufsize != len(buf):
+                # resize (grow for a large frame or shrink back after
+                # one) keeping any pending bytes
+                new = bytearray(bufsize)
+                new[:pending] = view[start:end]
+                view.release()
+                buf, view = new, memoryview(new)
+                start, end = 0, pending
+
+            elif len(buf) - start < need:
+                # not enough room left to fit the next frame; move the
+                # pending bytes to the front of the buffer
+                view[:pending] = view[start:end]
+                start, end = 0, pending
+
             try:
-                data = await self.stream.receive_some(2**10)
-                log.trace(f"received {data}")  # type: ignore
-            except trio.BrokenResourceError:
+                nbytes = await sock.recv_into(view[end:])
+                log.trace(f"received {nbytes} bytes")  # type: ignore
+            except OSError as err:
+                if err.errno == errno.EBADF:
+                    # same as ``trio.SocketStream.receive_some()``
+                    raise trio.ClosedResourceError from err
                 log.error(f"Stream connection {self.raddr} broke")
                 return
 
-            if data == b'':
+            if nbytes == 0:
                 log.debug(f"Stream connection {self.raddr} was closed")
                 return
 
-            unpacker.feed(data)
-            for packet in unpacker:
-                yield packet
+            end += nbytes
+
+    def set_codec(self, codec: Codec) -> None:
+        """Encode and decode all following messages with ``codec``.
+        """
+        self.codec = codec
 
     @property
     def laddr(self) -> Tuple[Any, ...]:
@@ -70,11 +208,106 @@ class MsgpackStream:
     def raddr(self) -> Tuple[Any, ...]:
         return self._raddr
 
+    def coalesce(
+        self,
+        max_latency: float = 0,
+        max_bytes: int = 2**16,
+    ) -> None:
+        """Queue outbound messages and write them in batches.
+
+        Queued messages are flushed ``max_latency`` seconds after the
+        first one was queued (or at the next scheduling tick if ``0``),
+        or as soon as ``max_bytes`` have been queued, whichever comes
+        first. Senders wait for the flush once the queue is full.
+        """
+        self._max_latency = max_latency
+        self._max_bytes = max_bytes
+
+    async def _write_batches(self) -> None:
+        """Flush the outbound queue until the stream is closed.
+
+        Runs as a system task such that it isn't bound to the lifetime
+        of whichever task happened to send first.
+        """
+        try:
+            while True:
+                await self._pending.wait()
+                if not self._outbuf:  # woken by ``.aclose()``
+                    return
+
+                if len(self._outbuf) < self._max_bytes:
+                    # give other tasks the chance to queue more
+                    with trio.move_on_after(self._max_latency):
+                        await self._full.wait()
+
+                buf, self._outbuf = self._outbuf, bytearray()
+                flushed, self._flushed = self._flushed, trio.Event()
+                self._pending = trio.Event()
+                self._full = trio.Event()
+                try:
+                    # don't interleave with a write started before
+                    # coalescing was enabled
+                    async with self._send_lock:
+                        await self.stream.send_all(buf)
+                finally:
+                    flushed.set()
+        except (trio.BrokenResourceError, trio.ClosedResourceError) as err:
+            # raised to senders on their next send
+            self._writer_err = err
+        finally:
+            self._writer_running = False
+
+    async def _queue(self, *parts: bytes) -> None:
+        if self._writer_err is not None:
+            raise self._writer_err
+
+        self._outbuf += _frame_hdr.pack(sum(map(len, parts)))
+        for part in parts:
+            self._outbuf += part
+        self._pending.set()
+        if not self._writer_running:
+            self._writer_running = True
+            trio.lowlevel.spawn_system_task(self._write_batches)
+
+        if len(self._outbuf) >= self._max_bytes:
+            # apply backpressure until the writer catches up
+            self._full.set()
+            await self._flushed.wait()
+            if self._writer_err is not None:
+                raise self._writer_err
+        else:
+            await trio.lowlevel.checkpoint()
+
+    async def _send_frame(self, *parts: bytes) -> None:
+        """Send a single frame made up of ``parts``.
+        """
+        if self._max_latency is not None:
+            return await self._queue(*parts)
+
+        async with self._send_lock:
+            return await self.stream.send_all(b''.join(
+                (_frame_hdr.pack(sum(map(len, parts))),) + parts))
+
     # XXX: should this instead be called `.sendall()`?
     async def send(self, data: Any) -> None:
-        async with self._send_lock:
-            return await self.stream.send_all(
-                msgpack.dumps(data, use_bin_type=True))
+        return await self._send_frame(*self.codec.encode(data))
+
+    async def send_enveloped(self, env: Any, data: Any) -> None:
+        """Send ``data`` as the value of a message wrapped in ``env``
+        as returned by ``.codec.envelope()``.
+        """
+        return await self._send_frame(
+            *self.codec.encode_enveloped(env, data))
+
+    async def aclose(self) -> None:
+        """Flush any queued messages then close the stream.
+        """
+        if self._outbuf and self._writer_running:
+            with trio.move_on_after(1):
+                await self._flushed.wait()
+        # wake an idle writer so it exits
+        self._pending.set()
+        await self.stream.aclose()
 
     async def recv(self) -> Any:
         return await self._agen.asend(None)
@@ -89,11 +322,12 @@ class MsgpackStream:
 class Channel:
     """An inter-process channel for communication between (remote) actors.
 
-    Currently the only supported transport is a ``trio.SocketStream``.
+    The transport is a ``trio.SocketStream`` over either tcp or, when the
+    far end actor is on the same host and serves one, a unix domain socket.
     """
     def __init__(
         self,
-        destaddr: Optional[Tuple[str, int]] = None,
+        destaddr: Optional[Union[Tuple[str, int], str]] = None,
         on_reconnect: typing.Callable[..., typing.Awaitable] = None,
         auto_reconnect: bool = False,
         stream: trio.SocketStream = None,  # expected to be active
@@ -107,10 +341,14 @@ class Channel:
                 f"A stream was provided with local addr {self.laddr}"
             )
         self._destaddr = self.msgstream.raddr if self.msgstream else destaddr
+        # whether the far end connected to us
+        self.accepted = stream is not None
         # set after handshake - always uid of far end
         self.uid: Optional[Tuple[str, str]] = None
         # set if far end actor errors internally
         self._exc: Optional[Exception] = None
+        # (max latency, max bytes) when write coalescing is enabled
+        self._coalesce: Optional[Tuple[float, int]] = None
         self._agen = self._aiter_recv()
 
     def __repr__(self) -> str:
@@ -129,22 +367,80 @@ class Channel:
         return self.msgstream.raddr if self.msgstream else None
 
     async def connect(
-        self, destaddr: Tuple[Any, ...] = None,
+        self, destaddr: Union[Tuple[Any, ...], str] = None,
         **kwargs
     ) -> trio.SocketStream:
+        """Connect to ``destaddr`` which is either a ``(host, port)``
+        tcp address or a unix domain socket path.
+
+        If the actor listening at a tcp address is on this host and
+        serves a unix domain socket, that socket is used instead.
+        """
         if self.connected():
             raise RuntimeError("channel is already connected?")
         destaddr = destaddr or self._destaddr
-        assert isinstance(destaddr, tuple)
-        stream = await trio.open_tcp_stream(*destaddr, **kwargs)
+
+        stream = None
+        if isinstance(destaddr, str):
+            stream = await trio.open_unix_socket(destaddr)
+        else:
+            assert isinstance(destaddr, tuple)
+            if has_uds:
+                path = uds_path(destaddr)
+                if os.path.exists(path):
+                    try:
+                        stream = await trio.open_unix_socket(path)
+                    except OSError:
+                        log.warning(
+                            f"Failed to connect to {path}, falling back"
+                            f" to tcp for {destaddr}")
+
+            if stream is None:
+                stream = await trio.open_tcp_stream(*destaddr, **kwargs)
+
         self.msgstream = MsgpackStream(stream)
+        if self._coalesce is not None:
+            self.msgstream.coalesce(*self._coalesce)
         return stream
 
+    def coalesce(
+        self,
+        max_latency: float = 0,
+        max_bytes: int = 2**16,
+    ) -> None:
+        """Coalesce outbound messages into batched writes.
+
+        See ``MsgpackStream.coalesce()``.
+        """
+        self._coalesce = (max_latency, max_bytes)
+        if self.msgstream:
+            self.msgstream.coalesce(max_latency, max_bytes)
+
     async def send(self, item: Any) -> None:
         log.trace(f"send `{item}`")  # type: ignore
         assert self.msgstream
         await self.msgstream.send(item)
 
+    @property
+    def codec(self) -> Codec:
+        assert self.msgstream
+        return self.msgstream.codec
+
+    def set_codec(self, name: str) -> None:
+        """Switch to the codec registered as ``name`` for all following
+        messages (in both directions).
+        """
+        assert self.msgstream
+        self.msgstream.set_codec(get_codec(name))
+
+    async def send_enveloped(self, env: Any, item: Any) -> None:
+        """Send ``item`` wrapped in an envelope made by
+        ``.codec.envelope()``.
+        """
+        log.trace(f"send enveloped `{item}`")  # type: ignore
+        assert self.msgstream
+        await self.msgstream.send_enveloped(env, item)
+
     async def recv(self) -> Any:
         assert self.msgstream
         try:
@@ -157,7 +453,7 @@ class Channel:
     async def aclose(self) -> None:
         log.debug(f"Closing {self}")
         assert self.msgstream
-        await self.msgstream.stream.aclose()
+        await self.msgstream.aclose()
 
     async def __aenter__(self):
         await self.connect()
@@ -229,12 +525,15 @@ class Channel:
 
 @asynccontextmanager
 async def _connect_chan(
-    host: str, port: int
+    host: str, port: Optional[int] = None,
 ) -> typing.AsyncGenerator[Channel, None]:
     """Create and connect a channel with disconnect on context manager
     teardown.
+
+    If no ``port`` is provided ``host`` is expected to be the path to
+    a unix domain socket.
     """
-    chan = Channel((host, port))
+    chan = Channel(host if port is None else (host, port))
     await chan.connect()
     yield chan
     await chan.aclose()
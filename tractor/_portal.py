@@ -113,6 +113,8 @@ class StreamReceiveChannel(trio.abc.ReceiveChannel):
         with trio.CancelScope(shield=True):
             await self._rx_chan.aclose()
 
+        self._portal.actor._close_shm_stream(self._portal.channel.uid, cid)
+
     def clone(self):
         return self
 
@@ -0,0 +1,302 @@
+"""
+Shared memory stream transport for same-host actors.
+
+Items yielded by a remote streaming function are written to a ring
+buffer in a ``multiprocessing.shared_memory`` segment instead of being
+sent over the channel's socket. The socket only carries the messages
+needed to coordinate the two ends:
+
+- ``{'shm_open': name, 'size': capacity, 'cid': cid}``: producer -> consumer
+  to attach the segment (at stream start)
+- ``{'shm_wakeup': pos, 'cid': cid}``: producer -> consumer indicating
+  there is unread data up to the ring write position ``pos``; only one
+  wakeup is outstanding at any time
+- ``{'shm_ack': bool, 'cid': cid}``: consumer -> producer after attaching
+  (``False`` if the attach failed) and after every wakeup once the
+  ring has been drained
+
+Items too large for the ring (or sent after the consumer failed to
+attach) are sent inline as normal ``'yield'`` messages including the
+write position at send time as ``'shm_pos'``. Any message for the
+stream's cid is only delivered after the consumer has drained the ring
+up to that position (or entirely for ``'stop'`` and ``'error'``
+messages after which nothing more is written) such that items are
+always delivered in order.
+"""
+import struct
+from typing import Any, Iterator, List, Optional, Union
+
+import trio
+
+from ._codec import Codec
+from ._ipc import Channel
+from .log import get_logger
+
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:  # py3.7
+    shared_memory = None
+
+has_shm = shared_memory is not None
+
+log = get_logger('tractor')
+
+
+def same_host(chan: Channel) -> bool:
+    """Bool determining if the far end of ``chan`` is on this host.
+    """
+    raddr = chan.raddr
+    if isinstance(raddr, str):  # unix domain socket
+        return True
+    if not raddr:
+        return False
+    host = raddr[0]
+    return host.startswith('127.') or host == '::1'
+
+
+class ShmRingBuffer:
+    """A single producer, single consumer byte ring of length prefixed
+    frames in a shared memory segment.
+
+    The segment starts with a header holding the (monotonically
+    increasing) write and read positions followed by the ring data.
+    """
+    _pos = struct.Struct('Q')
+    _hdr_size = 2 * _pos.size
+    _frame_hdr = struct.Struct('I')
+
+    def __init__(
+        self,
+        shm: 'shared_memory.SharedMemory',
+        capacity: int,
+    ) -> None:
+        self.shm = shm
+        self.capacity = capacity
+        self._buf: Optional[memoryview] = shm.buf
+
+    @classmethod
+    def create(cls, capacity: int) -> 'ShmRingBuffer':
+        shm = shared_memory.SharedMemory(
+            create=True, size=cls._hdr_size + capacity)
+        shm.buf[:cls._hdr_size] = bytes(cls._hdr_size)
+        return cls(shm, capacity)
+
+    @classmethod
+    def attach(cls, name: str, capacity: int) -> 'ShmRingBuffer':
+        shm = shared_memory.SharedMemory(name=name)
+        # the segment is owned (and unlinked) by the producer; keep
+        # this process' resource tracker from unlinking it at exit
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, capacity)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _get(self, offset: int) -> int:
+        return self._pos.unpack_from(self._buf, offset)[0]
+
+    def _set(self, offset: int, value: int) -> None:
+        self._pos.pack_into(self._buf, offset, value)
+
+    @property
+    def write_pos(self) -> int:
+        return self._get(0)
+
+    def unread(self) -> int:
+        """Number of bytes written but not yet read.
+        """
+        return self._get(0) - self._get(self._pos.size)
+
+    def _copy_in(self, pos: int, data: Union[bytes, memoryview]) -> None:
+        buf, hdr, cap = self._buf, self._hdr_size, self.capacity
+        i = pos % cap
+        first = min(len(data), cap - i)
+        buf[hdr + i:hdr + i + first] = data[:first]
+        if first < len(data):  # wrap around
+            buf[hdr:hdr + len(data) - first] = data[first:]
+
+    def _copy_out(self, pos: int, size: int) -> Union[bytes, memoryview]:
+        buf, hdr, cap = self._buf, self._hdr_size, self.capacity
+        i = pos % cap
+        if i + size <= cap:
+            return buf[hdr + i:hdr + i + size]
+        first = cap - i
+        return bytes(buf[hdr + i:hdr + cap]) + bytes(
+            buf[hdr:hdr + size - first])
+
+    def write(self, payload: bytes) -> bool:
+        """Write a frame, return ``False`` if there isn't enough free space.
+        """
+        size = self._frame_hdr.size + len(payload)
+        wpos = self._get(0)
+        if self.capacity - (wpos - self._get(self._pos.size)) < size:
+            return False
+        self._copy_in(wpos, self._frame_hdr.pack(len(payload)))
+        self._copy_in(wpos + self._frame_hdr.size, payload)
+        # publish only once the frame is fully written
+        self._set(0, wpos + size)
+        return True
+
+    def read(
+        self,
+        until: Optional[int] = None,
+    ) -> Iterator[Union[bytes, memoryview]]:
+        """Iterate all frames written so far or up to the write
+        position ``until``.
+
+        A frame's space is handed back to the producer when the
+        iterator is resumed so the yielded buffer must not be used
+        after that.
+        """
+        hdr_size = self._frame_hdr.size
+        wpos = self._get(0) if until is None else until
+        rpos = self._get(self._pos.size)
+        while rpos < wpos:
+            size, = self._frame_hdr.unpack(
+                bytes(self._copy_out(rpos, hdr_size)))
+            yield self._copy_out(rpos + hdr_size, size)
+            rpos += hdr_size + size
+            self._set(self._pos.size, rpos)
+
+    def close(self) -> None:
+        if self._buf is not None:
+            self._buf = None
+            self.shm.close()
+
+
+class ShmStreamSender:
+    """Producer end of a shared memory stream.
+
+    Used by ``Context.send_yield()`` for streams to same-host consumers.
+    """
+    # size of each stream's ring buffer
+    capacity: int = 2**22
+
+    def __init__(
+        self,
+        actor: 'Actor',  # type: ignore # noqa
+        chan: Channel,
+        cid: str,
+    ) -> None:
+        self.actor = actor
+        self.chan = chan
+        self.cid = cid
+        self._ring: Optional[ShmRingBuffer] = None
+        # set to ``False`` if the consumer failed to attach
+        self._attached: Optional[bool] = None
+        self._wakeup_pending = False
+        self._acked = trio.Event()
+
+    async def _open(self) -> None:
+        self._ring = ShmRingBuffer.create(self.capacity)
+        self.actor._shm_txs[(self.chan.uid, self.cid)] = self
+        await self.chan.send({
+            'shm_open': self._ring.name,
+            'size': self.capacity,
+            'cid': self.cid,
+        })
+        # wait for the consumer to attach before writing
+        await self._acked.wait()
+        if not self._attached:
+            log.warning(
+                f"{self.chan.uid} failed to attach shared memory stream "
+                f"{self.cid}, falling back to streaming over {self.chan}")
+
+    async def _wakeup(self) -> None:
+        if not self._wakeup_pending:
+            self._wakeup_pending = True
+            await self.chan.send({
+                'shm_wakeup': self._ring.write_pos,
+                'cid': self.cid,
+            })
+
+    async def _on_ack(self, attached: bool) -> None:
+        """Handle an ack from the consumer.
+
+        Called from the channel's message loop.
+        """
+        if self._attached is None:
+            self._attached = attached
+        else:
+            self._wakeup_pending = False
+            # data may have been written after the consumer drained
+            if self._ring is not None and self._ring.unread():
+                await self._wakeup()
+
+        self._acked.set()
+        self._acked = trio.Event()
+
+    async def send(self, data: Any) -> None:
+        if self._attached is None:
+            await self._open()
+
+        ring = self._ring
+        payload = b''.join(self.chan.codec.encode(data))
+        if (
+            not self._attached or
+            ring.capacity < ShmRingBuffer._frame_hdr.size + len(payload)
+        ):
+            # the consumer drains the ring up to the current write
+            # position before delivering this so ordering is maintained
+            await self.chan.send({
+                'yield': data,
+                'cid': self.cid,
+                'shm_pos': ring.write_pos,
+            })
+            return
+
+        while not ring.write(payload):
+            # ring is full; wait for the consumer to catch up
+            await self._wakeup()
+            await self._acked.wait()
+
+        await self._wakeup()
+
+    async def aclose(self) -> None:
+        self.actor._shm_txs.pop((self.chan.uid, self.cid), None)
+        if self._ring is not None:
+            self._ring.close()
+            # the consumer has already attached (or failed to)
+            # before any data was written so it's safe to unlink
+            self._ring.shm.unlink()
+            self._ring = None
+
+
+class ShmStreamReceiver:
+    """Consumer end of a shared memory stream.
+    """
+    def __init__(self, ring: ShmRingBuffer, codec: Codec) -> None:
+        self.ring = ring
+        self.codec = codec
+
+    def drain(self, until: Optional[int] = None) -> List[Any]:
+        """Return all items written to the ring so far or up to the
+        write position ``until``.
+        """
+        decode = self.codec.decode
+        return [
+            decode(memoryview(frame)) for frame in self.ring.read(until)
+        ]
+
+    def close(self) -> None:
+        self.ring.close()
+
+
+def attach(
+    name: str,
+    size: int,
+    codec: Codec,
+) -> Optional[ShmStreamReceiver]:
+    """Attach to a producer's ring buffer, return ``None`` on failure.
+
+    Items are decoded with ``codec`` (that of the stream's channel).
+    """
+    if not has_shm:
+        return None
+    try:
+        return ShmStreamReceiver(ShmRingBuffer.attach(name, size), codec)
+    except OSError:
+        log.exception(f"Failed to attach shared memory {name}")
+        return None
@@ -181,6 +181,13 @@ async def spawn_subactor(
             subactor.loglevel
         ]
 
+    # needed before the handshake with the parent (where they're
+    # negotiated) so can't be passed over the parent channel
+    spawn_cmd += [
+        "--codecs",
+        ",".join(subactor._codecs),
+    ]
+
     proc = await trio.open_process(spawn_cmd)
     try:
         yield proc
@@ -250,6 +257,9 @@ async def new_proc(
                     "rpc_module_paths": subactor.rpc_module_paths,
                     "statespace": subactor.statespace,
                     "_arb_addr": subactor._arb_addr,
+                    "_enable_uds": subactor._enable_uds,
+                    "_enable_shm": subactor._enable_shm,
+                    "_write_coalescing": subactor._write_coalescing,
                     "bind_host": bind_addr[0],
                     "bind_port": bind_addr[1],
                     "_runtime_vars": _runtime_vars,
@@ -1,11 +1,12 @@
 import inspect
 from contextvars import ContextVar
-from dataclasses import dataclass
-from typing import Any
+from dataclasses import dataclass, field
+from typing import Any, Optional
 
 import trio
 
 from ._ipc import Channel
+from ._shm import ShmStreamSender
 
 
 _context: ContextVar['Context'] = ContextVar('context')
@@ -22,9 +23,22 @@ class Context:
     chan: Channel
     cid: str
     cancel_scope: trio.CancelScope
+    # set for streams to same-host consumers when the actor
+    # streams over shared memory
+    _shm_tx: Optional[ShmStreamSender] = None
+    # (pre-encoded where the codec supports it) envelope of
+    # ``{'cid': cid, 'yield': ...}`` messages
+    _yield_env: Any = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self, '_yield_env', self.chan.codec.envelope('yield', self.cid))
 
     async def send_yield(self, data: Any) -> None:
-        await self.chan.send({'yield': data, 'cid': self.cid})
+        if self._shm_tx is not None:
+            await self._shm_tx.send(data)
+        else:
+            await self.chan.send_enveloped(self._yield_env, data)
 
     async def send_stop(self) -> None:
         await self.chan.send({'stop': True, 'cid': self.cid})
@@ -56,8 +56,21 @@ class ActorNursery:
         rpc_module_paths: List[str] = None,
         loglevel: str = None,  # set log level per subactor
         nursery: trio.Nursery = None,
+        enable_uds: Optional[bool] = None,
+        enable_shm: Optional[bool] = None,
+        write_coalescing: Optional[Tuple[float, int]] = None,
+        codecs: Optional[List[str]] = None,
     ) -> Portal:
         loglevel = loglevel or self._actor.loglevel or get_loglevel()
+        # inherit the transport settings of the spawning actor
+        if enable_uds is None:
+            enable_uds = self._actor._enable_uds
+        if enable_shm is None:
+            enable_shm = self._actor._enable_shm
+        if write_coalescing is None:
+            write_coalescing = self._actor._write_coalescing
+        if codecs is None:
+            codecs = self._actor._codecs
 
         # configure and pass runtime state
         _rtv = _state._runtime_vars.copy()
@@ -70,6 +83,10 @@ class ActorNursery:
             statespace=statespace,  # global proc state vars
             loglevel=loglevel,
             arbiter_addr=current_actor()._arb_addr,
+            enable_uds=enable_uds,
+            enable_shm=enable_shm,
+            write_coalescing=write_coalescing,
+            codecs=codecs,
         )
         parent_addr = self._actor.accept_addr
         assert parent_addr
@@ -101,6 +118,10 @@ class ActorNursery:
         rpc_module_paths: Optional[List[str]] = None,
         statespace: Dict[str, Any] = None,
         loglevel: str = None,  # set log level per subactor
+        enable_uds: Optional[bool] = None,
+        enable_shm: Optional[bool] = None,
+        write_coalescing: Optional[Tuple[float, int]] = None,
+        codecs: Optional[List[str]] = None,
         **kwargs,  # explicit args to ``fn``
     ) -> Portal:
         """Spawn a new actor, run a lone task, then terminate the actor and
@@ -117,6 +138,10 @@ class ActorNursery:
             bind_addr=bind_addr,
             statespace=statespace,
             loglevel=loglevel,
+            enable_uds=enable_uds,
+            enable_shm=enable_shm,
+            write_coalescing=write_coalescing,
+            codecs=codecs,
             # use the run_in_actor nursery
             nursery=self._ria_nursery,
         )